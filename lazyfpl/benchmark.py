@@ -0,0 +1,270 @@
+from __future__ import annotations
+
+import contextlib
+import io
+import json
+import math
+import pathlib
+import random
+import time
+import tracemalloc
+from typing import Callable, Literal, NamedTuple, Sequence, get_args
+
+import torch
+
+from lazyfpl import helpers, ml_model, optimizer, structures, transfer
+
+BENCHMARKS = Literal[
+    "lineup-bnb",
+    "lineup-loop",
+    "lineup-mitm",
+    "transfer",
+    "inference",
+]
+
+# Share of each position in a pool, as in a squad.
+POSITION_SHARES = (("GKP", 2), ("DEF", 5), ("MID", 5), ("FWD", 3))
+
+
+class Result(NamedTuple):
+    name: str
+    seconds: float
+    items: int
+    unit: str
+    peak_kib: float
+
+    def rate(self) -> float:
+        return self.items / self.seconds if self.seconds else math.inf
+
+
+def player_pool(
+    size: int,
+    seed: int = 0,
+    teams: int = 20,
+) -> list[structures.Player]:
+    """Builds a random pool of about `size` players, split over the positions
+    as in a squad, without touching the database or network."""
+    rnd = random.Random(seed)
+    pool = list[structures.Player]()
+    for position, share in POSITION_SHARES:
+        for i in range(max(size * share // 15, share)):
+            team = rnd.randrange(teams)
+            # Mostly cheap players, as in the game, pricier ones scoring more.
+            price = round(rnd.triangular(40, 130, 45) / 5) * 5
+            pool.append(
+                structures.Player(
+                    fixutres=[],
+                    name=f"{position} {i}",
+                    news="",
+                    position=position,  # type: ignore[arg-type]
+                    price=price,
+                    selected=0,
+                    team=f"Team {team}",
+                    team_short=f"T{team:02d}",
+                    webname=f"{position}{i}",
+                    xP=round(price / 10 * rnd.uniform(0.5, 1.5), 1),
+                )
+            )
+    return pool
+
+
+def lineups(
+    engine: optimizer.ENGINES,
+    pool: Sequence[structures.Player],
+    squads: int,
+) -> Callable[[], int]:
+    """Returns a run of the lineup engine over the pool, counting the squads
+    it returns."""
+    combinations = {
+        position: optimizer.position_combinations(
+            [p for p in pool if p.position == position],
+            n,
+        )
+        for position, n in POSITION_SHARES
+    }
+    searches: dict[str, Callable[..., list[structures.Squad]]] = {
+        "bnb": optimizer.lineups_bnb,
+        "loop": optimizer.lineups_xp,
+        "mitm": optimizer.lineups_mitm,
+    }
+    search = searches[engine]
+
+    def run() -> int:
+        return len(
+            search(
+                gkp_combinations=combinations["GKP"],
+                def_combinations=combinations["DEF"],
+                mid_combinations=combinations["MID"],
+                fwd_combinations=combinations["FWD"],
+                budget_lower=0,
+                n_squads=squads,
+            )
+        )
+
+    return run
+
+
+def transfers(
+    pool: Sequence[structures.Player],
+    max_transfers: int = 2,
+) -> Callable[[], int]:
+    """Returns a run of `transfer.transfer` from the first players of each
+    position in the pool, counting the transfers generated."""
+    current = [
+        p
+        for position, n in POSITION_SHARES
+        for p in [p for p in pool if p.position == position][:n]
+    ]
+
+    def run() -> int:
+        return sum(
+            1
+            for _ in transfer.transfer(
+                current=current,
+                pool=pool,
+                add=[],
+                remove=[],
+                max_transfers=max_transfers,
+                max_budget=max(helpers.squad_price(current), 1_000),
+            )
+        )
+
+    return run
+
+
+def inference(
+    pool: Sequence[structures.Player],
+    seed: int,
+    teams: int = 20,
+    lookahead: int = 3,
+    backtrace: int = 3,
+) -> Callable[[], int]:
+    """Returns a run of the network forward passes `ml_model.xP` makes for
+    every player in the pool, on an untrained network and random features,
+    counting the players."""
+    torch.manual_seed(seed)
+    # At home, minutes, opponent strength and points plus the opponent one-hot.
+    nfeature = 4 + teams
+    net = ml_model.Net(nfeature, backtrace=backtrace).eval()
+    features = torch.randn(len(pool), lookahead, 1, backtrace, nfeature)
+
+    def run() -> int:
+        with torch.no_grad():
+            for player in features:
+                for fixture in player:
+                    float(net(fixture).detach().numpy())
+        return len(pool)
+
+    return run
+
+
+def measure(
+    name: str,
+    unit: str,
+    run: Callable[[], int],
+    repeat: int,
+) -> Result:
+    """Times the best of `repeat` runs, then traces one more run for its peak
+    Python memory, tracing being too slow to time under."""
+    seconds = math.inf
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            items = run()
+            seconds = min(seconds, time.perf_counter() - start)
+
+        tracemalloc.start()
+        try:
+            run()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    return Result(name, seconds, items, unit, peak / 1024)
+
+
+def run(
+    benchmarks: Sequence[BENCHMARKS],
+    players: int,
+    repeat: int,
+    seed: int,
+    squads: int,
+) -> list[Result]:
+    """Runs the benchmarks on a pool of random players."""
+    pool = player_pool(players, seed)
+    results = list[Result]()
+    for name in benchmarks:
+        if name.startswith("lineup-"):
+            engine: optimizer.ENGINES = name.removeprefix("lineup-")  # type: ignore[assignment]
+            results.append(
+                measure(name, "squads", lineups(engine, pool, squads), repeat)
+            )
+        elif name == "transfer":
+            results.append(measure(name, "transfers", transfers(pool), repeat))
+        elif name == "inference":
+            results.append(measure(name, "players", inference(pool, seed), repeat))
+    return results
+
+
+def save(results: Sequence[Result], file: pathlib.Path) -> None:
+    file.write_text(json.dumps([r._asdict() for r in results], indent=2))
+
+
+def load(file: pathlib.Path) -> list[Result]:
+    return [Result(**r) for r in json.loads(file.read_text())]
+
+
+def compare(
+    results: Sequence[Result],
+    baseline: Sequence[Result],
+) -> list[dict[str, str | float | None]]:
+    """Table rows for the results, with the speedup and memory change against
+    the baseline result of the same name, if any."""
+    before = {r.name: r for r in baseline}
+    rows = list[dict[str, str | float | None]]()
+    for r in results:
+        row: dict[str, str | float | None] = {
+            "Benchmark": r.name,
+            "Seconds": round(r.seconds, 4),
+            "Rate": f"{r.rate():.4g} {r.unit}/s",
+            "Peak KiB": round(r.peak_kib, 1),
+        }
+        if baseline:
+            b = before.get(r.name)
+            row["Baseline seconds"] = None if b is None else round(b.seconds, 4)
+            row["Speedup"] = (
+                None if b is None or not r.seconds else round(b.seconds / r.seconds, 2)
+            )
+            row["Peak change"] = (
+                None
+                if b is None or not b.peak_kib
+                else f"{(r.peak_kib / b.peak_kib - 1):+.0%}"
+            )
+        rows.append(row)
+    return rows
+
+
+def main(
+    baseline: pathlib.Path | None,
+    benchmarks: list[str],
+    output: pathlib.Path | None,
+    players: int,
+    repeat: int,
+    seed: int,
+    squads: int,
+) -> None:
+    if unknown := set(benchmarks) - set(get_args(BENCHMARKS)):
+        raise ValueError(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    results = run(
+        benchmarks or list(get_args(BENCHMARKS)),  # type: ignore[arg-type]
+        players=players,
+        repeat=repeat,
+        seed=seed,
+        squads=squads,
+    )
+
+    if output:
+        save(results, output)
+
+    print(helpers.tabulater(compare(results, load(baseline) if baseline else [])))
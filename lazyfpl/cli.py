@@ -1,3 +1,6 @@
+import pathlib
+from typing import Literal
+
 import typer
 
 app = typer.Typer(
@@ -126,6 +129,16 @@ def lineup_optimizer(
         1000,
         help="Upper budget limit.",
     ),
+    checkpoint: float = typer.Option(
+        0,
+        help="Seconds between saving search progress to the database, "
+        "0 to never save (loop engine).",
+    ),
+    engine: Literal["bnb", "loop", "mitm"] = typer.Option(
+        "bnb",
+        help="Search engine, exact branch-and-bound, the legacy nested loops or "
+        "a sorted join of GKP+FWD and DEF+MID pairs.",
+    ),
     gkp_def_not_same_team: bool = typer.Option(
         False,
         help="Goalkeeper and defenders should not be from the same team.",
@@ -158,14 +171,39 @@ def lineup_optimizer(
         False,
         help="Exclude players with news attached to them.",
     ),
+    pareto: bool = typer.Option(
+        False,
+        help="Drop combinations dominated by keep-squad others, unless streaming.",
+    ),
     remove: list[str] = typer.Option(
         [],
         help="Players to remove from consideration.",
     ),
+    resume: bool = typer.Option(
+        False,
+        help="Continue from the last checkpoint of the same search (loop engine).",
+    ),
+    single_pass: bool = typer.Option(
+        False,
+        help="Scan once instead of rescanning with a lower cutoff (loop engine).",
+    ),
+    stream: bool = typer.Option(
+        False,
+        help="Generate combinations best first, only as many as the search needs.",
+    ),
+    time_limit: float = typer.Option(
+        0,
+        help="Seconds to search before returning the best squads found so far, "
+        "0 for no limit.",
+    ),
     top_position_price: int = typer.Option(
         0,
         help="Top players per position by price.",
     ),
+    workers: int = typer.Option(
+        1,
+        help="Processes to split a single-pass scan over (loop engine).",
+    ),
 ) -> None:
     """Optimize the best possible lineup within given constraints."""
     from lazyfpl import optimizer
@@ -173,6 +211,8 @@ def lineup_optimizer(
     optimizer.main(
         budget_lower,
         budget_upper,
+        checkpoint,
+        engine,
         gkp_def_not_same_team,
         include,
         keep_squad,
@@ -181,8 +221,14 @@ def lineup_optimizer(
         min_mtm,
         min_xp,
         no_news,
+        pareto,
         remove,
+        resume,
+        single_pass,
+        stream,
+        time_limit,
         top_position_price,
+        workers,
     )
 
 
@@ -238,5 +284,51 @@ def team() -> None:
     print(fetch.my_team())
 
 
+@app.command()
+def benchmark(
+    baseline: pathlib.Path | None = typer.Option(
+        None,
+        help="Results saved with --output to compare against.",
+    ),
+    only: list[str] = typer.Option(
+        [],
+        help="Benchmarks to run, all when not given: lineup-bnb, lineup-loop, "
+        "lineup-mitm, transfer and inference.",
+    ),
+    output: pathlib.Path | None = typer.Option(
+        None,
+        help="File to save the results to, as JSON.",
+    ),
+    players: int = typer.Option(
+        30,
+        help="Players in the random pool, split over positions as in a squad.",
+    ),
+    repeat: int = typer.Option(
+        3,
+        help="Runs to time per benchmark, the fastest is kept.",
+    ),
+    seed: int = typer.Option(
+        0,
+        help="Seed for the random pool.",
+    ),
+    squads: int = typer.Option(
+        100,
+        help="Squads to keep in the lineup benchmarks.",
+    ),
+) -> None:
+    """Time the optimizer, transfer and inference hot paths on random players."""
+    from lazyfpl import benchmark
+
+    benchmark.main(
+        baseline,
+        only,
+        output,
+        players,
+        repeat,
+        seed,
+        squads,
+    )
+
+
 if __name__ == "__main__":
     app()
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import collections as C
+import functools
 import typing as T
 
 from lazyfpl import structures
@@ -16,6 +17,66 @@ def team_constraint(lineup: T.Sequence[structures.Player], n: int) -> bool:
     return max(C.Counter(p.team for p in lineup).values()) <= n
 
 
+# Team tallies pack the number of players per team into one int, LANE_BITS
+# bits per team. The top bit of each lane is kept free to detect overflow.
+LANE_BITS = 5
+MAX_LANE_COUNT = (1 << (LANE_BITS - 1)) - 1
+TEAM_LANES = dict[str, int]()
+
+
+def team_tally(lineup: T.Iterable[structures.Player]) -> int:
+    """
+    Packs the number of players per team in the lineup into an int,
+    tallies of disjoint lineups add up to the tally of their union.
+    """
+    return sum(
+        1 << LANE_BITS * TEAM_LANES.setdefault(p.team, len(TEAM_LANES)) for p in lineup
+    )
+
+
+@functools.cache
+def lane_ones(lanes: int) -> int:
+    """
+    Returns an int with the lowest bit of the first 'lanes' lanes set.
+    """
+    return sum(1 << LANE_BITS * lane for lane in range(lanes))
+
+
+def tally_lanes(tally: int) -> int:
+    """
+    Returns the number of lanes covering every player in the tally.
+    """
+    return tally.bit_length() // LANE_BITS + 1
+
+
+@functools.cache
+def tally_limit(n: int, lanes: int) -> tuple[int, int]:
+    """
+    Returns the bias pushing any lane count above 'n' into the top bit
+    of its lane, and the mask of those top bits, for 'lanes' lanes.
+    """
+    assert 0 <= n <= MAX_LANE_COUNT
+    return lane_ones(lanes) * (MAX_LANE_COUNT - n), lane_ones(lanes) << (LANE_BITS - 1)
+
+
+def tally_constraint(tally: int, n: int) -> bool:
+    """
+    Same as team_constraint on a packed team tally, any lane must hold
+    at most MAX_LANE_COUNT players.
+    """
+    bias, high = tally_limit(n, tally_lanes(tally))
+    return not (tally + bias) & high
+
+
+def tally_teams(tally: int) -> int:
+    """
+    Returns a mask with the lowest bit of every lane holding at least
+    one player set.
+    """
+    ones = lane_ones(tally_lanes(tally))
+    return (tally + ones * MAX_LANE_COUNT) >> (LANE_BITS - 1) & ones
+
+
 def gkp_def_same_team(
     lineup: T.Sequence[structures.Player],
 ) -> bool:
@@ -28,3 +89,50 @@ def gkp_def_same_team(
     gkps = {p.team for p in lineup if p.position == "GKP"}
     defs = {p.team for p in lineup if p.position == "DEF"}
     return bool(gkps.intersection(defs))
+
+
+def gkp_def_same_tally(gkp_tally: int, def_tally: int) -> bool:
+    """
+    Same as gkp_def_same_team on the packed team tallies of the
+    goalkeepers and the defenders.
+    """
+    return bool(tally_teams(gkp_tally) & tally_teams(def_tally))
+
+
+class SquadRules(T.NamedTuple):
+    """
+    Rules on top of the team limit the lineup search checks as soon as the
+    positions a rule looks at are picked, rather than on finished squads.
+    Rules on a single position go in allows_combination and drop its
+    combinations before the search, rules across GKP and DEF in
+    allows_gkp_def.
+    """
+
+    gkp_def_not_same_team: bool = False
+    # Most defenders from one team, 0 for no limit.
+    max_def_per_team: int = 0
+
+    def restricts(self, position: structures.POSITIONS) -> bool:
+        """
+        Returns True if allows_combination can reject combinations of
+        the position.
+        """
+        return position == "DEF" and self.max_def_per_team > 0
+
+    def allows_combination(self, position: structures.POSITIONS, tally: int) -> bool:
+        """
+        Checks the rules on a single position against the packed team
+        tally of one of its combinations.
+        """
+        if position == "DEF" and self.max_def_per_team:
+            return tally_constraint(tally, self.max_def_per_team)
+        return True
+
+    def allows_gkp_def(self, gkp_tally: int, def_tally: int) -> bool:
+        """
+        Checks the rules across GKP and DEF against the packed team
+        tallies of their combinations.
+        """
+        return not (
+            self.gkp_def_not_same_team and gkp_def_same_tally(gkp_tally, def_tally)
+        )
@@ -171,3 +171,60 @@ def minutes() -> structures.Summary:
             )
         ]
     )
+
+
+def create_checkpoint_table() -> None:
+    """Creates the table lineup search checkpoints are saved in, if missing."""
+    execute(
+        """
+        CREATE TABLE IF NOT EXISTS checkpoint (
+            key TEXT PRIMARY KEY,
+            state BLOB NOT NULL
+        )
+    """
+    )
+
+
+def save_checkpoint(key: str, state: bytes) -> None:
+    """Saves a search checkpoint under the given key, replacing any previous one."""
+    create_checkpoint_table()
+    execute(
+        """
+        INSERT OR REPLACE INTO
+            checkpoint (key, state)
+        VALUES
+            (?, ?)
+    """,
+        (key, state),
+    )
+
+
+def load_checkpoint(key: str) -> bytes | None:
+    """Loads the search checkpoint saved under the given key, None if there is none."""
+    create_checkpoint_table()
+    rows = execute(
+        """
+        SELECT
+            state
+        FROM
+            checkpoint
+        WHERE
+            key = ?
+    """,
+        (key,),
+    )
+    return rows[0]["state"] if rows else None
+
+
+def delete_checkpoint(key: str) -> None:
+    """Deletes the search checkpoint saved under the given key."""
+    create_checkpoint_table()
+    execute(
+        """
+        DELETE FROM
+            checkpoint
+        WHERE
+            key = ?
+    """,
+        (key,),
+    )
@@ -54,6 +54,32 @@ def best_lineup_xP(lineup: Sequence[structures.Player]) -> float:
     return squad_xP(best_lineup(lineup))
 
 
+def sorted_lineup_xP(
+    gkps: Sequence[float],
+    defs: Sequence[float],
+    mids: Sequence[float],
+    fwds: Sequence[float],
+    min_gkp: int = 1,
+    min_def: int = 3,
+    min_mid: int = 2,
+    min_fwd: int = 1,
+    size: int = 11,
+) -> float:
+    """Same as best_lineup_xP, from the xP of each position sorted highest
+    first. The tails left after the position minimums are sorted runs which
+    sorted merges, and the sum is taken in the same order for the same float."""
+    best = (*gkps[:min_gkp], *defs[:min_def], *mids[:min_mid], *fwds[:min_fwd])
+    return sum(
+        (
+            *best,
+            *sorted(
+                (*defs[min_def:], *mids[min_mid:], *fwds[min_fwd:]),
+                reverse=True,
+            )[: size - len(best)],
+        )
+    )
+
+
 def valid_squad(
     squad: Sequence[structures.Player],
     gkps: int = 2,
@@ -1,19 +1,61 @@
 from __future__ import annotations
 
 import collections
+import concurrent.futures
+import dataclasses
+import functools
+import hashlib
 import heapq
 import itertools
-from typing import Generator, NamedTuple
+import math
+import multiprocessing
+import pickle
+import time
+from typing import Any, Callable, Generator, Iterable, Literal, NamedTuple, Sequence
 
+import numpy as np
 from tqdm.std import tqdm
 
-from lazyfpl import constraints, fetch, helpers, structures
+from lazyfpl import constraints, database, fetch, helpers, structures
+
+ENGINES = Literal["bnb", "loop", "mitm"]
 
 
 class PositionCombination(NamedTuple):
     price: int
     xP: float
     players: tuple[structures.Player, ...]
+    teams: int
+    xps: tuple[float, ...]
+
+    @staticmethod
+    def fromplayers(players: tuple[structures.Player, ...]) -> PositionCombination:
+        """Creates a PositionCombination, teams being the packed team tally
+        of the players and xps their xP sorted highest first."""
+        return PositionCombination(
+            helpers.squad_price(players),
+            helpers.squad_xP(players),
+            players,
+            constraints.team_tally(players),
+            tuple(sorted((p.xP or 0 for p in players), reverse=True)),
+        )
+
+
+def squad_players(
+    parts: Sequence[PositionCombination],
+) -> tuple[structures.Player, ...]:
+    """Returns the players of a squad made up of position combinations."""
+    return tuple(p for c in parts for p in c.players)
+
+
+def squad_overall_xP(parts: Sequence[PositionCombination]) -> float:
+    """Same as helpers.overall_xP for the squad made up of the position
+    combinations, taking the best lineup from their sorted xP."""
+    xps = {c.players[0].position: c.xps for c in parts}
+    return (
+        sum(p.xP or 0 for c in parts for p in c.players) ** 2
+        + helpers.sorted_lineup_xP(xps["GKP"], xps["DEF"], xps["MID"], xps["FWD"]) ** 2
+    ) ** 0.5
 
 
 def position_combinations(
@@ -25,7 +67,7 @@ def position_combinations(
     assert combinations > 0
     return sorted(
         (
-            PositionCombination(helpers.squad_price(c), helpers.squad_xP(c), c)
+            PositionCombination.fromplayers(c)
             for c in itertools.combinations(pool, combinations)
         ),
         key=lambda x: (x[1], -x[0]),
@@ -33,6 +75,78 @@ def position_combinations(
     )
 
 
+def iter_position_combinations(
+    pool: list[structures.Player],
+    combinations: int,
+) -> Generator[PositionCombination, None, None]:
+    """Lazily yields the same combinations as `position_combinations`, in the
+    same order, without building them all up front.
+
+    Combinations are index tuples into the pool sorted by xP, searched best
+    first: every successor swaps one player for the next one down, so no
+    successor beats the combination it came from. Combinations within float
+    noise of each other are collected and sorted before they are yielded.
+    """
+    assert combinations > 0
+    order = sorted(range(len(pool)), key=lambda i: pool[i].xP or 0, reverse=True)
+
+    def entry(
+        positions: tuple[int, ...],
+    ) -> tuple[float, int, tuple[int, ...], tuple[int, ...], PositionCombination]:
+        indices = tuple(sorted(order[p] for p in positions))
+        c = PositionCombination.fromplayers(tuple(pool[i] for i in indices))
+        # Ties are broken as in position_combinations, by price and then by
+        # the order itertools.combinations yields them in.
+        return -c.xP, c.price, indices, positions, c
+
+    if combinations > len(pool):
+        return
+
+    start = tuple(range(combinations))
+    heap = [entry(start)]
+    seen = {start}
+    batch = list[
+        tuple[float, int, tuple[int, ...], tuple[int, ...], PositionCombination]
+    ]()
+    while heap:
+        current = heapq.heappop(heap)
+        if batch and current[0] > batch[0][0] + 1e-9:
+            yield from (c for *_, c in sorted(batch))
+            batch.clear()
+        batch.append(current)
+
+        positions = current[3]
+        for i, position in enumerate(positions):
+            if position + 1 < len(pool) and position + 1 not in positions:
+                successor = positions[:i] + (position + 1,) + positions[i + 1 :]
+                if successor not in seen:
+                    seen.add(successor)
+                    heapq.heappush(heap, entry(successor))
+
+    yield from (c for *_, c in sorted(batch))
+
+
+class CombinationStream:
+    """Materializes combinations from an iterable, in order, as they are
+    asked for."""
+
+    def __init__(self, combinations: Iterable[PositionCombination]) -> None:
+        self.combinations = iter(combinations)
+        self.taken = list[PositionCombination]()
+        self.peek = next(self.combinations, None)
+
+    def take(self, n: int) -> list[PositionCombination]:
+        """Returns the first n combinations, or all if there are fewer."""
+        while len(self.taken) < n and self.peek is not None:
+            self.taken.append(self.peek)
+            self.peek = next(self.combinations, None)
+        return self.taken[:n]
+
+    def next_xp(self) -> float:
+        """xP of the first combination not taken yet, -inf if none is left."""
+        return -math.inf if self.peek is None else self.peek.xP
+
+
 def position_price_candidates(
     pool: list[structures.Player],
     topn: int,
@@ -58,12 +172,741 @@ def must_include(
 ) -> list[PositionCombination]:
     """Filters combinations to only include certain players."""
     return (
-        [c for c in combinations if all(i in c[-1] for i in include)]
+        [c for c in combinations if all(i in c.players for i in include)]
         if include
         else combinations
     )
 
 
+def follow_rules(
+    rules: constraints.SquadRules,
+    combinations: Sequence[list[PositionCombination]],
+    positions: Sequence[structures.POSITIONS] = ("GKP", "DEF", "MID", "FWD"),
+) -> list[list[PositionCombination]]:
+    """Filters the combinations of each position to the ones the rules on
+    that position alone allow."""
+    return [
+        [c for c in cs if rules.allows_combination(position, c.teams)]
+        if rules.restricts(position)
+        else cs
+        for cs, position in zip(combinations, positions)
+    ]
+
+
+def pareto_front(
+    combinations: list[PositionCombination],
+    keep: int,
+    same_price: bool = False,
+) -> list[PositionCombination]:
+    """Drops combinations dominated by at least `keep` others with the same
+    team tally, keeping the order of the rest.
+
+    A combination dominates another if it costs no more and its players' xP,
+    sorted, are at least as high one by one. Swapping it in keeps a squad
+    valid and its squad and overall xP no lower, so the best `keep` squads can
+    all be built from what is left. A cheaper swap can drop a squad below the
+    lower budget, with `same_price` only equally priced combinations count.
+    """
+    assert keep > 0
+
+    groups = collections.defaultdict[tuple[int, int], list[int]](list)
+    for i, c in enumerate(combinations):
+        groups[(c.teams, c.price if same_price else 0)].append(i)
+
+    dropped = set[int]()
+    for group in groups.values():
+        if len(group) <= keep:
+            continue
+
+        xps = np.array(
+            [
+                sorted((p.xP or 0 for p in combinations[i].players), reverse=True)
+                for i in group
+            ]
+        )
+        prices = np.array([combinations[i].price for i in group])
+        # Sorted by xP, then price, only a combination earlier in the order
+        # can dominate a later one, which also settles equal combinations.
+        order = np.lexsort((prices, -xps.sum(axis=1)))
+        xps, prices = xps[order], prices[order]
+        for start in range(keep, len(group), 256):
+            stop = min(start + 256, len(group))
+            # [j, i] compares combination j against combination start + i.
+            covers = prices[:stop, None] <= prices[None, start:stop]
+            for column in xps.T:
+                covers &= column[:stop, None] >= column[None, start:stop]
+            covers &= np.arange(stop)[:, None] < np.arange(start, stop)[None, :]
+            dropped.update(
+                group[order[start + i]]
+                for i in np.flatnonzero(covers.sum(axis=0) >= keep).tolist()
+            )
+
+    return [c for i, c in enumerate(combinations) if i not in dropped]
+
+
+@dataclasses.dataclass
+class SearchStats:
+    passes: int = 0
+    evaluated: int = 0
+    # Squad xP a squad had to reach to be kept in the last search.
+    cutoff: float = -math.inf
+    # Highest squad xP in the part of the last search its deadline cut off,
+    # -inf when it ran to the end.
+    bound: float = -math.inf
+    # Lowest of the best n_squads squad xPs the last search found.
+    worst: float = -math.inf
+
+    def gap(self) -> float:
+        """How much better than the worst kept squad xP a squad left out by
+        the deadline could be, 0 when none can."""
+        return max(0.0, self.bound - self.worst)
+
+    def __str__(self) -> str:
+        text = f"Search passes: {self.passes} Evaluated squads: {self.evaluated}"
+        if self.bound > -math.inf:
+            text += f" Optimality gap: {self.gap():.1f}"
+        return text
+
+
+class TopSquads:
+    """Collects the squads the rescan loop of `lineups_xp` settles on in a
+    single pass.
+
+    That loop keeps the squads whose squad xP clears a cutoff it lowers by
+    `score_decay` until `n_squads` squads qualify, so the cutoff it stops at is
+    the first decayed value at or below the `n_squads`-th best squad xP. That
+    squad xP times `score_decay` is a lower bound on it which only rises as
+    better squads turn up, and squads below it can be dropped right away.
+    """
+
+    def __init__(
+        self,
+        n_squads: int,
+        score_decay: float,
+        best_squad_xp: float,
+    ) -> None:
+        self.n_squads = n_squads
+        self.score_decay = score_decay
+        self.best_squad_xp = best_squad_xp
+        self.sequence = 0
+        self.threshold = [-math.inf]
+        self.squad_xps = list[float]()
+        self.candidates = list[
+            tuple[float, int, int, tuple[PositionCombination, ...]]
+        ]()
+
+    def push(
+        self,
+        squad_xp: float,
+        price: int,
+        squad: tuple[PositionCombination, ...],
+    ) -> None:
+        """Adds a valid squad, raising the threshold once n_squads are seen."""
+        if squad_xp < self.threshold[0]:
+            return
+
+        self.sequence += 1
+        heapq.heappush(self.candidates, (squad_xp, self.sequence, price, squad))
+        (heapq.heappushpop if len(self.squad_xps) >= self.n_squads else heapq.heappush)(
+            self.squad_xps, squad_xp
+        )
+
+        if len(self.squad_xps) >= self.n_squads:
+            self.threshold[0] = self.squad_xps[0] * self.score_decay
+            while self.candidates[0][0] < self.threshold[0]:
+                heapq.heappop(self.candidates)
+
+    def dump(
+        self,
+        encode: Callable[[tuple[PositionCombination, ...]], tuple[int, ...]],
+    ) -> dict[str, Any]:
+        """Returns the collected state, squads encoded with `encode`."""
+        return {
+            "threshold": self.threshold[0],
+            "sequence": self.sequence,
+            "squad_xps": self.squad_xps,
+            "candidates": [(x, n, p, encode(s)) for x, n, p, s in self.candidates],
+        }
+
+    def restore(
+        self,
+        state: dict[str, Any],
+        decode: Callable[[tuple[int, ...]], tuple[PositionCombination, ...]],
+    ) -> None:
+        """Picks up the state `dump` returned."""
+        self.threshold[0] = state["threshold"]
+        self.sequence = state["sequence"]
+        self.squad_xps = state["squad_xps"]
+        self.candidates = [(x, n, p, decode(s)) for x, n, p, s in state["candidates"]]
+
+    def squads(self, stats: SearchStats) -> list[structures.Squad]:
+        """Returns the kept squads ranked by overall xP, lowest first, as
+        `lineups_xp` does."""
+        cutoff = -math.inf
+        if len(self.squad_xps) >= self.n_squads:
+            cutoff = self.best_squad_xp
+            while cutoff > self.squad_xps[0]:
+                cutoff *= self.score_decay
+        stats.cutoff = cutoff
+        stats.worst = self.squad_xps[0] if self.squad_xps else -math.inf
+
+        best_squads = list[
+            tuple[tuple[float, int, int], tuple[PositionCombination, ...]]
+        ]()
+        for squad_xp, sequence, price, squad in sorted(
+            self.candidates,
+            key=lambda x: x[1],
+        ):
+            if squad_xp < cutoff:
+                continue
+
+            stats.evaluated += 1
+            if (oxp := squad_overall_xP(squad)) > cutoff:
+                (
+                    heapq.heappushpop
+                    if len(best_squads) >= self.n_squads
+                    else heapq.heappush
+                )(best_squads, ((round(oxp, 1), price, sequence), squad))
+
+        return [
+            structures.Squad(squad_players(heapq.heappop(best_squads)[-1]))
+            for _ in range(len(best_squads))
+        ]
+
+
+class RescanSquads:
+    """Collects the squads for the rescan loop of `lineups_xp`, keeping the
+    `n_squads` best by overall xP that clear the cutoff of the current pass."""
+
+    def __init__(self, n_squads: int, best_squad_xp: float, stats: SearchStats) -> None:
+        self.n_squads = n_squads
+        self.stats = stats
+        self.threshold = [best_squad_xp]
+        self.sequence = 0
+        self.best_squads = list[
+            tuple[tuple[float, float, int], tuple[PositionCombination, ...]]
+        ]()
+        # The squads in best_squads, kept in step with it for constant time lookups.
+        self.kept = set[tuple[PositionCombination, ...]]()
+
+    def push(
+        self,
+        squad_xp: float,
+        price: int,
+        squad: tuple[PositionCombination, ...],
+    ) -> None:
+        self.stats.evaluated += 1
+        if (oxp := squad_overall_xP(squad)) > self.threshold[0] and (
+            squad not in self.kept
+        ):
+            self.kept.add(squad)
+            self.sequence += 1
+            item = ((round(oxp, 1), price, self.sequence), squad)
+            if len(self.best_squads) >= self.n_squads:
+                self.kept.remove(heapq.heappushpop(self.best_squads, item)[-1])
+            else:
+                heapq.heappush(self.best_squads, item)
+
+    def dump(
+        self,
+        encode: Callable[[tuple[PositionCombination, ...]], tuple[int, ...]],
+    ) -> dict[str, Any]:
+        """Returns the collected state, squads encoded with `encode`."""
+        return {
+            "threshold": self.threshold[0],
+            "sequence": self.sequence,
+            "best_squads": [(key, encode(s)) for key, s in self.best_squads],
+        }
+
+    def restore(
+        self,
+        state: dict[str, Any],
+        decode: Callable[[tuple[int, ...]], tuple[PositionCombination, ...]],
+    ) -> None:
+        """Picks up the state `dump` returned."""
+        self.threshold[0] = state["threshold"]
+        self.sequence = state["sequence"]
+        self.best_squads = [(key, decode(s)) for key, s in state["best_squads"]]
+        self.kept = {s for _, s in self.best_squads}
+
+    def squads(self) -> list[structures.Squad]:
+        """Returns the kept squads ranked by overall xP, lowest first."""
+        return [
+            structures.Squad(squad_players(heapq.heappop(self.best_squads)[-1]))
+            for _ in range(len(self.best_squads))
+        ]
+
+
+class ScanCheckpoint:
+    """Saves the progress of a `lineups_xp` scan to the database every
+    `interval` seconds, keyed by a hash of the combinations, in order, and the
+    search parameters so a checkpoint is only picked up by the same search.
+
+    Squads are stored as GKP, FWD, DEF and MID combination indices.
+    """
+
+    def __init__(
+        self,
+        combinations: Sequence[Sequence[PositionCombination]],
+        parameters: tuple,
+        interval: float,
+    ) -> None:
+        self.combinations = combinations
+        self.interval = interval
+        self.saved = time.monotonic()
+        digest = hashlib.sha256(repr(parameters).encode())
+        for position in combinations:
+            for c in position:
+                digest.update(
+                    repr([(p.name, p.team, p.price, p.xP) for p in c.players]).encode()
+                )
+        self.key = digest.hexdigest()
+        self.index = [{id(c): i for i, c in enumerate(cs)} for cs in combinations]
+
+    def encode(self, squad: tuple[PositionCombination, ...]) -> tuple[int, ...]:
+        return tuple(i[id(c)] for i, c in zip(self.index, squad))
+
+    def decode(self, indices: tuple[int, ...]) -> tuple[PositionCombination, ...]:
+        return tuple(cs[i] for cs, i in zip(self.combinations, indices))
+
+    def load(self) -> dict[str, Any] | None:
+        """Returns the last saved state, None if there is none."""
+        state = database.load_checkpoint(self.key)
+        return None if state is None else pickle.loads(state)
+
+    def save(self, state: Callable[[], dict[str, Any]]) -> None:
+        """Saves the state once `interval` seconds have passed since the last
+        save, a zero interval never saves."""
+        if self.interval and time.monotonic() - self.saved >= self.interval:
+            database.save_checkpoint(self.key, pickle.dumps(state()))
+            self.saved = time.monotonic()
+
+    def clear(self) -> None:
+        database.delete_checkpoint(self.key)
+
+    def progress(
+        self,
+        top: TopSquads | RescanSquads,
+        stats: SearchStats,
+        offset: int,
+    ) -> Callable[[int], None]:
+        """Returns a progress callback for the scan collecting into top,
+        offset being the index of the first GKP combination it scans."""
+
+        def save(gkp: int) -> None:
+            self.save(
+                lambda: {
+                    **top.dump(self.encode),
+                    "gkp": offset + gkp,
+                    "passes": stats.passes,
+                    "evaluated": stats.evaluated,
+                }
+            )
+
+        return save
+
+
+class CombinationArrays(NamedTuple):
+    """Column view of position combinations for masked array checks."""
+
+    combinations: Sequence[PositionCombination]
+    price: np.ndarray
+    xP: np.ndarray
+    negxP: np.ndarray
+    teams: np.ndarray
+    best_xp: np.ndarray
+
+    @staticmethod
+    def fromcombinations(
+        combinations: Sequence[PositionCombination],
+        team_index: dict[str, int],
+    ) -> CombinationArrays:
+        """Builds the arrays, teams[i, t] counting players from team t
+        in combination i and best_xp[p] the highest xP at price p."""
+        size = len(combinations[0].players) if combinations else 0
+        xp = np.fromiter((c.xP for c in combinations), dtype=np.float64)
+        price = np.fromiter((c.price for c in combinations), dtype=np.int64)
+        best_xp = np.full(int(price.max(initial=-1)) + 1, -np.inf)
+        np.maximum.at(best_xp, price, xp)
+        teams = np.fromiter(
+            (team_index[p.team] for c in combinations for p in c.players),
+            dtype=np.intp,
+            count=len(combinations) * size,
+        ).reshape(len(combinations), size)
+        return CombinationArrays(
+            combinations=combinations,
+            price=price,
+            xP=xp,
+            negxP=-xp,
+            teams=np.eye(len(team_index), dtype=np.int8)[teams].sum(
+                axis=1,
+                dtype=np.int8,
+            ),
+            best_xp=best_xp,
+        )
+
+    def reaching(self, xp: float, threshold: float) -> int:
+        """Number of leading combinations, sorted by xP, that can still lift
+        `xp` to the threshold. Errs on the long side, callers mask exactly."""
+        return int(np.searchsorted(self.negxP, xp - threshold + 1e-9, side="right"))
+
+
+def window_max(values: np.ndarray, width: int) -> np.ndarray:
+    """Returns an array where index i holds the max of values[i : i + width + 1],
+    built by doubling the span covered."""
+    size = width + 1
+    best = np.concatenate((values, np.full(size, -np.inf)))
+    span = 1
+    while span * 2 <= size:
+        best[:-span] = np.maximum(best[:-span], best[span:])
+        span *= 2
+    return np.maximum(
+        best[: len(values)],
+        best[size - span : size - span + len(values)],
+    )
+
+
+def max_plus(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Returns an array where index p holds the highest a[i] + b[p - i]."""
+    best = np.full(len(a) + len(b) - 1, -np.inf)
+    for i in np.flatnonzero(a > -np.inf):
+        np.maximum(best[i : i + len(b)], a[i] + b, out=best[i : i + len(b)])
+    return best
+
+
+class PriceWindows(NamedTuple):
+    """Highest MID and DEF plus MID xP within the budget window, index p
+    covering prices p up to p plus the window width. The last index is
+    -inf, lookups past the end land on it."""
+
+    mids: np.ndarray
+    pairs: np.ndarray
+
+    @staticmethod
+    def fromarrays(
+        defs: CombinationArrays,
+        mids: CombinationArrays,
+        width: int,
+    ) -> PriceWindows:
+        return PriceWindows(
+            mids=np.append(window_max(mids.best_xp, width), -np.inf),
+            pairs=np.append(
+                window_max(max_plus(defs.best_xp, mids.best_xp), width),
+                -np.inf,
+            ),
+        )
+
+    @staticmethod
+    def best(window: np.ndarray, lowest: Any) -> Any:
+        """Highest xP in the window starting at the lowest price(s) allowed,
+        prices below zero are clamped to zero."""
+        if isinstance(lowest, int):
+            return float(window[min(max(lowest, 0), len(window) - 1)])
+        return window[np.clip(lowest, 0, len(window) - 1)]
+
+
+def nested_loops(
+    gkp_combinations: list[PositionCombination],
+    defs: CombinationArrays,
+    mids: CombinationArrays,
+    fwd_combinations: list[PositionCombination],
+    team_index: dict[str, int],
+    windows: PriceWindows,
+    threshold: list[float],
+    visit: Callable[[float, int, tuple[PositionCombination, ...]], None],
+    budget_lower: int,
+    budget_upper: int,
+    max_players_per_team: int,
+    bar: tqdm,
+    deadline: float = math.inf,
+    progress: Callable[[int], None] | None = None,
+    rules: constraints.SquadRules = constraints.SquadRules(),
+) -> float:
+    """Calls visit with the squad xP, price and position combinations, in
+    squad order, of every valid squad whose squad xP reaches threshold[0],
+    which visit may raise.
+
+    GKP and FWD are looped over, DEF and MID candidates are checked for each
+    prefix with one masked array operation and visited in xP order. The price
+    windows cut prefixes and DEF candidates that cannot reach the threshold
+    with what the budget window leaves for the rest.
+
+    Returns -inf, or once `time.monotonic()` passes the deadline, the highest
+    squad xP the prefixes left could reach. Progress is called with the index
+    of each GKP combination before it is scanned. The rules across GKP and
+    DEF are checked on the DEF candidates of each GKP combination.
+    """
+    max_mid_price = int(mids.price.max())
+    min_mid_price = int(mids.price.min())
+    max_mid_xp = float(mids.xP.max())
+
+    max_def_price = int(defs.price.max())
+    min_def_price = int(defs.price.min())
+    max_def_xp = float(defs.xP.max())
+
+    for gi, gc in enumerate(gkp_combinations):
+        if progress is not None:
+            progress(gi)
+
+        gp, gxp, g, gteams, _ = gc
+        # SquadRules.allows_gkp_def over all DEF combinations at once.
+        gkp_def = (
+            ~defs.teams[:, [team_index[p.team] for p in g]].any(axis=1)
+            if rules.gkp_def_not_same_team
+            else np.ones(len(defs.combinations), dtype=bool)
+        )
+        for fc in fwd_combinations:
+            fp, fxp, f, fteams, _ = fc
+            if time.monotonic() > deadline:
+                # Both lists are sorted by xP, so the best prefix left is this
+                # one or the next GKP with the best FWD.
+                return (
+                    max(
+                        gxp + fxp,
+                        gkp_combinations[gi + 1].xP + fwd_combinations[0].xP
+                        if gi + 1 < len(gkp_combinations)
+                        else -math.inf,
+                    )
+                    + max_def_xp
+                    + max_mid_xp
+                )
+
+            bar.update(len(defs.combinations) * len(mids.combinations))
+
+            if gxp + fxp + max_def_xp + max_mid_xp < threshold[0]:
+                # Could use break, but messes up tqdm.
+                continue
+
+            if gp + fp + min_def_price + min_mid_price > budget_upper:
+                continue
+
+            if gp + fp + max_def_price + max_mid_price < budget_lower:
+                continue
+
+            if not constraints.tally_constraint(gteams + fteams, max_players_per_team):
+                continue
+
+            if (
+                gxp
+                + fxp
+                + PriceWindows.best(windows.pairs, budget_lower - gp - fp)
+                + 1e-9
+                < threshold[0]
+            ):
+                continue
+
+            gf_teams = np.zeros(len(team_index), dtype=np.int8)
+            for p in g + f:
+                gf_teams[team_index[p.team]] += 1
+
+            n = defs.reaching(gxp + fxp + max_mid_xp, threshold[0])
+            gfd_price = gp + fp + defs.price[:n]
+            for di in np.flatnonzero(
+                (gxp + fxp + defs.xP[:n] + max_mid_xp >= threshold[0])
+                & (gfd_price + min_mid_price <= budget_upper)
+                & (gfd_price + max_mid_price >= budget_lower)
+                & (
+                    gxp
+                    + fxp
+                    + defs.xP[:n]
+                    + PriceWindows.best(windows.mids, budget_lower - gfd_price)
+                    + 1e-9
+                    >= threshold[0]
+                )
+                & (
+                    (defs.teams[:n] + gf_teams).max(axis=1, initial=0)
+                    <= max_players_per_team
+                )
+                & gkp_def[:n]
+            ).tolist():
+                dc = defs.combinations[di]
+                dp, dxp = dc.price, dc.xP
+                if gxp + fxp + dxp + max_mid_xp < threshold[0]:
+                    # Visit raised the threshold, the rest are sorted below it.
+                    break
+
+                m = mids.reaching(gxp + fxp + dxp, threshold[0])
+                squad_xps = gxp + fxp + dxp + mids.xP[:m]
+                prices = gp + fp + dp + mids.price[:m]
+                for mi in np.flatnonzero(
+                    (squad_xps >= threshold[0])
+                    & (budget_lower <= prices)
+                    & (prices <= budget_upper)
+                    & (
+                        (mids.teams[:m] + gf_teams + defs.teams[di]).max(
+                            axis=1, initial=0
+                        )
+                        <= max_players_per_team
+                    )
+                ).tolist():
+                    if (squad_xp := float(squad_xps[mi])) < threshold[0]:
+                        break
+
+                    visit(
+                        squad_xp,
+                        int(prices[mi]),
+                        (gc, fc, dc, mids.combinations[mi]),
+                    )
+
+    return -math.inf
+
+
+class ShardScan(NamedTuple):
+    """Everything a worker process needs to scan GKP shards for `lineups_xp`."""
+
+    gkp_combinations: list[PositionCombination]
+    defs: CombinationArrays
+    mids: CombinationArrays
+    fwd_combinations: list[PositionCombination]
+    team_index: dict[str, int]
+    windows: PriceWindows
+    budget_lower: int
+    budget_upper: int
+    max_players_per_team: int
+    n_squads: int
+    score_decay: float
+    best_squad_xp: float
+    deadline: float
+    rules: constraints.SquadRules
+
+
+# Set in each worker process by init_shard_worker.
+shard_scan: ShardScan | None = None
+shard_cutoff: Any = None
+shard_index = list[dict[int, int]]()
+
+
+def init_shard_worker(scan: ShardScan, cutoff: Any) -> None:
+    global shard_scan, shard_cutoff, shard_index  # noqa: PLW0603
+    shard_scan = scan
+    shard_cutoff = cutoff
+    # Combinations are looked up by identity, they stay put in the worker.
+    shard_index = [
+        {id(c): i for i, c in enumerate(combinations)}
+        for combinations in (
+            scan.gkp_combinations,
+            scan.fwd_combinations,
+            scan.defs.combinations,
+            scan.mids.combinations,
+        )
+    ]
+
+
+def scan_gkp_shard(
+    gkp: int,
+) -> tuple[float, list[tuple[float, int, tuple[int, ...]]]]:
+    """Scans the squads built on one GKP combination, returning the bound
+    `nested_loops` returns and the squad xP, price and GKP, FWD, DEF and MID
+    combination indices of the `TopSquads` candidates, in visit order.
+
+    A shard's own threshold never exceeds the one a full scan ends up with,
+    so the best of them is shared through `shard_cutoff` to prune the others.
+    """
+    assert shard_scan is not None
+    scan = shard_scan
+    top = TopSquads(scan.n_squads, scan.score_decay, scan.best_squad_xp)
+    top.threshold[0] = shard_cutoff.value
+
+    def visit(
+        squad_xp: float,
+        price: int,
+        squad: tuple[PositionCombination, ...],
+    ) -> None:
+        top.push(squad_xp, price, squad)
+        if top.threshold[0] > shard_cutoff.value:
+            with shard_cutoff.get_lock():
+                shard_cutoff.value = max(shard_cutoff.value, top.threshold[0])
+        else:
+            top.threshold[0] = shard_cutoff.value
+
+    bound = nested_loops(
+        scan.gkp_combinations[gkp : gkp + 1],
+        scan.defs,
+        scan.mids,
+        scan.fwd_combinations,
+        scan.team_index,
+        scan.windows,
+        top.threshold,
+        visit,
+        scan.budget_lower,
+        scan.budget_upper,
+        scan.max_players_per_team,
+        tqdm(disable=True),
+        scan.deadline,
+        rules=scan.rules,
+    )
+    return bound, [
+        (squad_xp, price, tuple(i[id(c)] for i, c in zip(shard_index, squad)))
+        for squad_xp, _, price, squad in sorted(top.candidates, key=lambda x: x[1])
+    ]
+
+
+def print_combinations(
+    gkp_combinations: list[PositionCombination],
+    def_combinations: list[PositionCombination],
+    mid_combinations: list[PositionCombination],
+    fwd_combinations: list[PositionCombination],
+) -> int:
+    """Prints and returns the number of combinations to search."""
+    total = (
+        len(gkp_combinations)
+        * len(def_combinations)
+        * len(mid_combinations)
+        * len(fwd_combinations)
+    )
+    print(f"Goalkeeper combinations: {len(gkp_combinations):.1e}")
+    print(f"Defender   combinations: {len(def_combinations):.1e}")
+    print(f"Midfielder combinations: {len(mid_combinations):.1e}")
+    print(f"Forwarder  combinations: {len(fwd_combinations):.1e}")
+    print(f"Total      combinations: {total:.1e}")
+    return total
+
+
+def scan_shards(
+    scan: ShardScan,
+    workers: int,
+    top: TopSquads,
+    bar: tqdm,
+    *,
+    start: int = 0,
+    progress: Callable[[int], None] | None = None,
+) -> float:
+    """Scans the GKP shards from `start` on over a pool of worker processes,
+    pushing their candidates into top and calling progress with the index of
+    each shard before it is pushed. Returns the highest bound the shards
+    return."""
+    bound = -math.inf
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=init_shard_worker,
+        initargs=(scan, multiprocessing.Value("d", top.threshold[0])),
+    ) as pool:
+        # Shards come back in GKP order, so squads are pushed in the
+        # same order a single process visits them.
+        for gkp, (shard_bound, candidates) in enumerate(
+            pool.map(scan_gkp_shard, range(start, len(scan.gkp_combinations))),
+            start,
+        ):
+            # Shards cut short by the deadline leave nothing to resume from.
+            if progress is not None and bound == -math.inf:
+                progress(gkp)
+
+            bound = max(bound, shard_bound)
+            bar.update(bar.total // len(scan.gkp_combinations))
+            for squad_xp, price, (g, f, d, m) in candidates:
+                top.push(
+                    squad_xp,
+                    price,
+                    (
+                        scan.gkp_combinations[g],
+                        scan.fwd_combinations[f],
+                        scan.defs.combinations[d],
+                        scan.mids.combinations[m],
+                    ),
+                )
+    return bound
+
+
 def lineups_xp(
     gkp_combinations: list[PositionCombination],
     def_combinations: list[PositionCombination],
@@ -74,28 +917,54 @@ def lineups_xp(
     n_squads: int = 1_000,
     max_players_per_team: int = 3,
     score_decay: float = 0.995,
+    single_pass: bool = False,
+    stats: SearchStats | None = None,
+    workers: int = 1,
+    deadline: float = math.inf,
+    checkpoint: float = 0.0,
+    resume: bool = False,
+    rules: constraints.SquadRules = constraints.SquadRules(),
 ) -> list[structures.Squad]:
-    """Generates the best possible lineups within given constraints."""
+    """Generates the best possible lineups within given constraints.
+
+    By default the squad xP cutoff is lowered by `score_decay` and the whole
+    space rescanned until `n_squads` squads clear it. With `single_pass` the
+    same squads are collected in one scan, see `TopSquads`. More than one
+    worker splits that single scan by GKP combination over processes.
+
+    Once `time.monotonic()` passes the deadline the scan stops with the best
+    squads found so far, recording a bound on the rest in `stats`. A deadline
+    implies `single_pass`, a rescan has nothing to return part way.
+
+    Every `checkpoint` seconds the progress is saved between GKP combinations,
+    see `ScanCheckpoint`, and `resume` picks up the last one saved for the
+    same search. A search run to the end deletes its checkpoint.
+
+    Only squads the rules allow are scanned, see `constraints.SquadRules`.
+    """
     # All combinations sorted from higest -> lowest xP.
     assert 0 < score_decay < 1
 
-    total = (
-        len(gkp_combinations)
-        * len(def_combinations)
-        * len(mid_combinations)
-        * len(fwd_combinations)
+    if stats is None:
+        stats = SearchStats()
+
+    gkp_combinations, def_combinations, mid_combinations, fwd_combinations = (
+        follow_rules(
+            rules,
+            (gkp_combinations, def_combinations, mid_combinations, fwd_combinations),
+        )
     )
 
-    print(f"Goalkeeper combinations: {len(gkp_combinations):.1e}")
-    print(f"Defender   combinations: {len(def_combinations):.1e}")
-    print(f"Midfielder combinations: {len(mid_combinations):.1e}")
-    print(f"Forwarder  combinations: {len(fwd_combinations):.1e}")
-    print(f"Total      combinations: {total:.1e}")
+    total = print_combinations(
+        gkp_combinations,
+        def_combinations,
+        mid_combinations,
+        fwd_combinations,
+    )
 
     if not total:
         return []
 
-    best_squads = list[tuple[tuple[float, float, int], tuple[structures.Player, ...]]]()
     best_squad_xp = sum(
         (
             gkp_combinations[0][1],
@@ -105,15 +974,74 @@ def lineups_xp(
         )
     )
 
-    max_mid_price = max(price for price, _, _ in mid_combinations)
-    min_mid_price = min(price for price, _, _ in mid_combinations)
-    max_mid_xp = max(xp for _, xp, _ in mid_combinations)
+    teams = {
+        p.team
+        for combinations in (
+            gkp_combinations,
+            def_combinations,
+            mid_combinations,
+            fwd_combinations,
+        )
+        for c in combinations
+        for p in c.players
+    }
+    team_index = {team: i for i, team in enumerate(sorted(teams))}
+    defs = CombinationArrays.fromcombinations(def_combinations, team_index)
+    mids = CombinationArrays.fromcombinations(mid_combinations, team_index)
+    windows = PriceWindows.fromarrays(defs, mids, budget_upper - budget_lower)
 
-    max_def_price = max(price for price, _, _ in def_combinations)
-    min_def_price = min(price for price, _, _ in def_combinations)
-    max_def_xp = max(xp for _, xp, _ in def_combinations)
+    # Workers and deadlines only run a single pass, resuming needs to know.
+    single_pass = single_pass or workers > 1 or deadline < math.inf
+    restart = (
+        ScanCheckpoint(
+            (gkp_combinations, fwd_combinations, def_combinations, mid_combinations),
+            (
+                budget_lower,
+                budget_upper,
+                n_squads,
+                max_players_per_team,
+                score_decay,
+                single_pass,
+                rules,
+            ),
+            checkpoint,
+        )
+        if checkpoint or resume
+        else None
+    )
+    state = restart.load() if restart is not None and resume else None
+    start = 0 if state is None else state["gkp"]
 
-    sequence: int = 0
+    def scan(
+        top: TopSquads | RescanSquads,
+        start: int = 0,
+    ) -> None:
+        stats.passes += 1
+        bar.reset()
+        bar.update(start * (total // len(gkp_combinations)))
+        bar.set_postfix_str(f"Squad xP cutoff: {max(top.threshold[0], 0):.1f}")
+        stats.bound = nested_loops(
+            gkp_combinations[start:],
+            defs,
+            mids,
+            fwd_combinations,
+            team_index,
+            windows,
+            top.threshold,
+            top.push,
+            budget_lower,
+            budget_upper,
+            max_players_per_team,
+            bar,
+            deadline,
+            None if restart is None else restart.progress(top, stats, start),
+            rules,
+        )
+
+    if state is not None:
+        # The pass the checkpoint was saved in is counted again below.
+        stats.passes += state["passes"] - 1
+        stats.evaluated += state["evaluated"]
 
     with tqdm(
         ascii=True,
@@ -122,82 +1050,549 @@ def lineups_xp(
         total=total,
         unit_scale=True,
     ) as bar:
-        while len(best_squads) < min(n_squads, total) and best_squad_xp > 0:
-            best_squad_xp *= score_decay
-            bar.reset()
-            bar.set_postfix_str(f"Squad xP cutoff: {best_squad_xp:.1f}")
-            for gp, gxp, g in gkp_combinations:
-                for fp, fxp, f in fwd_combinations:
-                    bar.update(len(def_combinations) * len(mid_combinations))
-
-                    if gxp + fxp + max_def_xp + max_mid_xp < best_squad_xp:
-                        # Could use break, but messes up tqdm.
-                        continue
-
-                    if gp + fp + min_def_price + min_mid_price > budget_upper:
-                        continue
-
-                    if gp + fp + max_def_price + max_mid_price < budget_lower:
-                        continue
-
-                    if not constraints.team_constraint(g + f, max_players_per_team):
-                        continue
-
-                    for dp, dxp, d in def_combinations:
-                        if gxp + fxp + dxp + max_mid_xp < best_squad_xp:
-                            break
-
-                        if gp + fp + dp + min_mid_price > budget_upper:
-                            continue
-
-                        if gp + fp + dp + max_mid_price < budget_lower:
-                            continue
-
-                        if not constraints.team_constraint(
-                            g + f + d, max_players_per_team
-                        ):
-                            continue
-
-                        for mp, mxp, m in mid_combinations:
-                            if gxp + fxp + dxp + mxp < best_squad_xp:
-                                break
-
-                            if (
-                                budget_lower
-                                <= (price := mp + dp + fp + gp)
-                                <= budget_upper
-                                and constraints.team_constraint(
-                                    squad := g + f + d + m,
-                                    n=max_players_per_team,
-                                )
-                                and (oxp := helpers.overall_xP(squad)) > best_squad_xp
-                                and not any(squad == s for _, s in best_squads)
-                            ):
-                                (
-                                    heapq.heappushpop
-                                    if len(best_squads) >= n_squads
-                                    else heapq.heappush
-                                )(
-                                    best_squads,
-                                    (
-                                        (
-                                            round(oxp, 1),
-                                            price,
-                                            sequence := sequence + 1,
-                                        ),
-                                        squad,
-                                    ),
-                                )
+        if single_pass:
+            top = TopSquads(n_squads, score_decay, best_squad_xp)
+            if state is not None and restart is not None:
+                top.restore(state, restart.decode)
 
-    return [
-        structures.Squad(heapq.heappop(best_squads)[-1])
-        for _ in range(len(best_squads))
-    ]
+            if workers > 1:
+                stats.passes += 1
+                stats.bound = scan_shards(
+                    ShardScan(
+                        gkp_combinations,
+                        defs,
+                        mids,
+                        fwd_combinations,
+                        team_index,
+                        windows,
+                        budget_lower,
+                        budget_upper,
+                        max_players_per_team,
+                        n_squads,
+                        score_decay,
+                        best_squad_xp,
+                        deadline,
+                        rules,
+                    ),
+                    workers,
+                    top,
+                    bar,
+                    start=start,
+                    progress=None
+                    if restart is None
+                    else restart.progress(top, stats, 0),
+                )
+            else:
+                scan(top, start)
+            squads = top.squads(stats)
+        else:
+            rescan = RescanSquads(n_squads, best_squad_xp, stats)
+            if state is not None and restart is not None:
+                rescan.restore(state, restart.decode)
+                scan(rescan, start)
+
+            while (
+                len(rescan.best_squads) < min(n_squads, total)
+                and rescan.threshold[0] > 0
+            ):
+                rescan.threshold[0] *= score_decay
+                scan(rescan)
+
+            stats.cutoff = rescan.threshold[0]
+            squads = rescan.squads()
+
+    if restart is not None and stats.bound == -math.inf:
+        restart.clear()
+
+    print(stats)
+    return squads
+
+
+def best_xp_table(
+    prices: np.ndarray,
+    xps: np.ndarray,
+    budget: int,
+    suffix: np.ndarray,
+) -> np.ndarray:
+    """Chains combinations in front of a `suffix` table, returning an array
+    where index `b` holds the highest xP reachable with a total price of at
+    most `b`, -inf where nothing fits."""
+    fits = (prices >= 0) & (prices <= budget)
+    per_price = np.full(budget + 1, -np.inf)
+    np.maximum.at(per_price, prices[fits], xps[fits])
+
+    best = np.full(budget + 1, -np.inf)
+    for price in np.flatnonzero(per_price > -np.inf):
+        np.maximum(
+            best[price:],
+            per_price[price] + suffix[: budget + 1 - price],
+            out=best[price:],
+        )
+    return best
+
+
+class LevelBounds(NamedTuple):
+    """Per level bounds on what the remaining levels can add, index i covering
+    level i and onwards."""
+
+    best_xp: list[np.ndarray]
+    max_xp: list[float]
+    max_price: list[int]
+
+    @staticmethod
+    def fromlevels(
+        levels: Sequence[Sequence[PositionCombination]],
+        budget: int,
+    ) -> LevelBounds:
+        """Builds the bounds, best_xp[i][b] being the highest xP levels i and
+        onwards can add with at most b left to spend."""
+        best_xp = [np.empty(0)] * len(levels) + [np.zeros(budget + 1)]
+        max_xp = [0.0] * (len(levels) + 1)
+        max_price = [0] * (len(levels) + 1)
+        for i in reversed(range(len(levels))):
+            prices = np.fromiter((c.price for c in levels[i]), dtype=np.int64)
+            xps = np.fromiter((c.xP for c in levels[i]), dtype=np.float64)
+            best_xp[i] = best_xp_table(prices, xps, budget, best_xp[i + 1])
+            max_xp[i] = max_xp[i + 1] + float(xps.max())
+            max_price[i] = max_price[i + 1] + int(prices.max())
+        return LevelBounds(best_xp, max_xp, max_price)
+
+
+def branch_and_bound(
+    levels: Sequence[Sequence[PositionCombination]],
+    bounds: LevelBounds,
+    threshold: list[float],
+    visit: Callable[[float, int, tuple[PositionCombination, ...]], None],
+    budget_lower: int,
+    budget_upper: int,
+    max_players_per_team: int,
+    deadline: float = math.inf,
+    allows: Callable[[tuple[PositionCombination, ...], PositionCombination], bool]
+    | None = None,
+) -> float:
+    """Calls visit with the squad xP, price and position combinations, one per
+    level, of every valid squad whose squad xP can still reach threshold[0],
+    which visit may raise.
+
+    A branch is cut as soon as the best xP the remaining levels can add within
+    the remaining budget falls short of the threshold, or allows, if given,
+    rejects a combination with the ones picked on the levels above.
+
+    Returns -inf, or once `time.monotonic()` passes the deadline, the highest
+    squad xP the branches left could reach.
+    """
+    bound = -math.inf
+
+    def descend(
+        level: int,
+        price: int,
+        xp: float,
+        parts: tuple[PositionCombination, ...],
+        teams: int,
+    ) -> bool:
+        nonlocal bound
+        last = level == len(levels) - 1
+        for c in levels[level]:
+            cprice, cxp, _, cteams, _ = c
+            if time.monotonic() > deadline:
+                # Combinations are sorted by xP, this one bounds the rest.
+                bound = max(bound, xp + cxp + bounds.max_xp[level + 1])
+                return True
+
+            if not level:
+                bar.update(1)
+
+            # Bounds are summed in another order than the squad xP, the slack
+            # keeps float rounding from cutting squads right on the threshold.
+            if xp + cxp + bounds.max_xp[level + 1] + 1e-9 < threshold[0]:
+                # Combinations are sorted by xP, none of the rest can do better.
+                break
+
+            if (remaining := budget_upper - price - cprice) < 0:
+                continue
+
+            if price + cprice + bounds.max_price[level + 1] < budget_lower:
+                continue
+
+            if xp + cxp + bounds.best_xp[level + 1][remaining] + 1e-9 < threshold[0]:
+                continue
+
+            if not constraints.tally_constraint(teams + cteams, max_players_per_team):
+                continue
+
+            if allows is not None and not allows(parts, c):
+                continue
+
+            if last:
+                visit(xp + cxp, price + cprice, (*parts, c))
+            elif descend(
+                level + 1,
+                price + cprice,
+                xp + cxp,
+                (*parts, c),
+                teams + cteams,
+            ):
+                # Out of time, the next combination records its bound.
+                continue
+        return False
+
+    with tqdm(
+        ascii=True,
+        leave=True,
+        ncols=80,
+        total=len(levels[0]),
+        unit_scale=True,
+    ) as bar:
+        bar.set_postfix_str(f"Squad xP cutoff: {max(threshold[0], 0):.1f}")
+        descend(0, 0, 0.0, (), 0)
+        bar.update(bar.total - bar.n)
+    return bound
+
+
+def lineups_bnb(
+    gkp_combinations: list[PositionCombination],
+    def_combinations: list[PositionCombination],
+    mid_combinations: list[PositionCombination],
+    fwd_combinations: list[PositionCombination],
+    budget_lower: int = 900,
+    budget_upper: int = 1_000,
+    n_squads: int = 1_000,
+    max_players_per_team: int = 3,
+    score_decay: float = 0.995,
+    stats: SearchStats | None = None,
+    deadline: float = math.inf,
+    rules: constraints.SquadRules = constraints.SquadRules(),
+) -> list[structures.Squad]:
+    """Generates the same lineups as `lineups_xp` with a single
+    branch-and-bound search, collecting squads with `TopSquads`."""
+    assert 0 < score_decay < 1
+
+    if stats is None:
+        stats = SearchStats()
+
+    gkp_combinations, def_combinations, mid_combinations, fwd_combinations = (
+        follow_rules(
+            rules,
+            (gkp_combinations, def_combinations, mid_combinations, fwd_combinations),
+        )
+    )
+
+    levels = (gkp_combinations, fwd_combinations, def_combinations, mid_combinations)
+
+    def allows(
+        parts: tuple[PositionCombination, ...],
+        c: PositionCombination,
+    ) -> bool:
+        # DEF is the third level, the GKP combination the first part.
+        return len(parts) != 2 or rules.allows_gkp_def(parts[0].teams, c.teams)
+
+    total = print_combinations(
+        gkp_combinations,
+        def_combinations,
+        mid_combinations,
+        fwd_combinations,
+    )
+
+    if not total:
+        return []
+
+    top = TopSquads(
+        n_squads,
+        score_decay,
+        sum(
+            (
+                gkp_combinations[0][1],
+                def_combinations[0][1],
+                mid_combinations[0][1],
+                fwd_combinations[0][1],
+            )
+        ),
+    )
+    stats.passes += 1
+    stats.bound = branch_and_bound(
+        levels,
+        LevelBounds.fromlevels(levels, budget_upper),
+        top.threshold,
+        top.push,
+        budget_lower,
+        budget_upper,
+        max_players_per_team,
+        deadline,
+        allows if rules.gkp_def_not_same_team else None,
+    )
+    squads = top.squads(stats)
+    print(stats)
+    return squads
+
+
+class PairArrays(NamedTuple):
+    """GKP and FWD combination pairs that fit the budget and team limit
+    together, sorted by price, with `window` holding the best pair xP from
+    price p up to p plus the budget window width."""
+
+    pairs: list[tuple[PositionCombination, PositionCombination]]
+    price: np.ndarray
+    xP: np.ndarray
+    teams: list[int]
+    window: np.ndarray
+
+    @staticmethod
+    def fromcombinations(
+        gkp_combinations: list[PositionCombination],
+        fwd_combinations: list[PositionCombination],
+        budget_upper: int,
+        width: int,
+        max_players_per_team: int,
+    ) -> PairArrays:
+        pairs = sorted(
+            (
+                (gc, fc)
+                for gc in gkp_combinations
+                for fc in fwd_combinations
+                if gc.price + fc.price <= budget_upper
+                and constraints.tally_constraint(
+                    gc.teams + fc.teams,
+                    max_players_per_team,
+                )
+            ),
+            key=lambda x: x[0].price + x[1].price,
+        )
+        price = np.fromiter((gc.price + fc.price for gc, fc in pairs), dtype=np.int64)
+        xp = np.fromiter((gc.xP + fc.xP for gc, fc in pairs), dtype=np.float64)
+        best_xp = np.full(int(price.max(initial=-1)) + 1, -np.inf)
+        np.maximum.at(best_xp, price, xp)
+        return PairArrays(
+            pairs=pairs,
+            price=price,
+            xP=xp,
+            teams=[gc.teams + fc.teams for gc, fc in pairs],
+            window=np.append(window_max(best_xp, width), -np.inf),
+        )
+
+
+def sorted_join(
+    pairs: PairArrays,
+    def_combinations: list[PositionCombination],
+    mid_combinations: list[PositionCombination],
+    threshold: list[float],
+    visit: Callable[[float, int, tuple[PositionCombination, ...]], None],
+    budget_lower: int,
+    budget_upper: int,
+    max_players_per_team: int,
+    bar: tqdm,
+    deadline: float = math.inf,
+    rules: constraints.SquadRules = constraints.SquadRules(),
+) -> float:
+    """Calls visit with the squad xP, price and position combinations of every
+    valid squad whose squad xP can still reach threshold[0], which visit may
+    raise. Returns -inf, or once `time.monotonic()` passes the deadline, the
+    highest squad xP the DEF and MID pairs left could reach.
+
+    DEF and MID pairs are generated best first from the two xP sorted lists
+    and joined with the price sorted GKP and FWD pairs their price leaves room
+    for, found by bisection. The search stops once the best DEF and MID pair
+    left cannot reach the threshold with the best GKP and FWD pair. The rules
+    across GKP and DEF are checked on the joined squads.
+    """
+    if not pairs.pairs or not def_combinations or not mid_combinations:
+        return -math.inf
+
+    pair_max_xp = float(pairs.xP.max())
+    heap = [(-(def_combinations[0].xP + mid_combinations[0].xP), 0, 0)]
+    while heap:
+        negxp, di, mi = heapq.heappop(heap)
+        # Bounds are summed in another order than the squad xP, the slack
+        # keeps float rounding from cutting squads right on the threshold.
+        if pair_max_xp - negxp + 1e-9 < threshold[0]:
+            break
+
+        if time.monotonic() > deadline:
+            # Pairs come off the heap best first.
+            return pair_max_xp - negxp
+
+        dc = def_combinations[di]
+        if mi + 1 < len(mid_combinations):
+            heapq.heappush(
+                heap,
+                (-(dc.xP + mid_combinations[mi + 1].xP), di, mi + 1),
+            )
+        if not mi and di + 1 < len(def_combinations):
+            heapq.heappush(
+                heap,
+                (-(def_combinations[di + 1].xP + mid_combinations[0].xP), di + 1, 0),
+            )
+        bar.update(1)
+
+        mc = mid_combinations[mi]
+        dm_price = dc.price + mc.price
+        if (
+            PriceWindows.best(pairs.window, budget_lower - dm_price) - negxp + 1e-9
+            < threshold[0]
+        ):
+            continue
+
+        dm_teams = dc.teams + mc.teams
+        if not constraints.tally_constraint(dm_teams, max_players_per_team):
+            continue
+
+        lo, hi = np.searchsorted(
+            pairs.price,
+            (budget_lower - dm_price, budget_upper - dm_price + 1),
+        )
+        squad_xps = pairs.xP[lo:hi] + dc.xP + mc.xP
+        for k in np.flatnonzero(squad_xps >= threshold[0]).tolist():
+            gc, fc = pairs.pairs[lo + k]
+            if constraints.tally_constraint(
+                pairs.teams[lo + k] + dm_teams,
+                max_players_per_team,
+            ) and rules.allows_gkp_def(gc.teams, dc.teams):
+                visit(
+                    float(squad_xps[k]),
+                    int(pairs.price[lo + k]) + dm_price,
+                    (gc, fc, dc, mc),
+                )
+    return -math.inf
+
+
+def lineups_mitm(
+    gkp_combinations: list[PositionCombination],
+    def_combinations: list[PositionCombination],
+    mid_combinations: list[PositionCombination],
+    fwd_combinations: list[PositionCombination],
+    budget_lower: int = 900,
+    budget_upper: int = 1_000,
+    n_squads: int = 1_000,
+    max_players_per_team: int = 3,
+    score_decay: float = 0.995,
+    stats: SearchStats | None = None,
+    deadline: float = math.inf,
+    rules: constraints.SquadRules = constraints.SquadRules(),
+) -> list[structures.Squad]:
+    """Generates the same lineups as `lineups_xp` by joining GKP and FWD
+    pairs with DEF and MID pairs, collecting squads with `TopSquads`."""
+    assert 0 < score_decay < 1
+
+    if stats is None:
+        stats = SearchStats()
+
+    gkp_combinations, def_combinations, mid_combinations, fwd_combinations = (
+        follow_rules(
+            rules,
+            (gkp_combinations, def_combinations, mid_combinations, fwd_combinations),
+        )
+    )
+
+    total = print_combinations(
+        gkp_combinations,
+        def_combinations,
+        mid_combinations,
+        fwd_combinations,
+    )
+
+    if not total:
+        return []
+
+    top = TopSquads(
+        n_squads,
+        score_decay,
+        sum(
+            (
+                gkp_combinations[0][1],
+                def_combinations[0][1],
+                mid_combinations[0][1],
+                fwd_combinations[0][1],
+            )
+        ),
+    )
+    stats.passes += 1
+    with tqdm(ascii=True, leave=True, ncols=80, unit_scale=True) as bar:
+        stats.bound = sorted_join(
+            PairArrays.fromcombinations(
+                gkp_combinations,
+                fwd_combinations,
+                budget_upper,
+                budget_upper - budget_lower,
+                max_players_per_team,
+            ),
+            def_combinations,
+            mid_combinations,
+            top.threshold,
+            top.push,
+            budget_lower,
+            budget_upper,
+            max_players_per_team,
+            bar,
+            deadline,
+            rules,
+        )
+    squads = top.squads(stats)
+    print(stats)
+    return squads
+
+
+def lineups_streamed(
+    lineups: Callable[..., list[structures.Squad]],
+    *,
+    gkp_combinations: CombinationStream,
+    def_combinations: CombinationStream,
+    mid_combinations: CombinationStream,
+    fwd_combinations: CombinationStream,
+    size: int = 1_024,
+    stats: SearchStats | None = None,
+    **kwargs: Any,
+) -> list[structures.Squad]:
+    """Runs lineups on the first combinations of each stream only, taking
+    twice as many from a stream while a squad built with the ones it left
+    out could still reach the squad xP cutoff. Squads below it are never
+    kept, so the result is the same as from the full lists."""
+    if stats is None:
+        stats = SearchStats()
+
+    streams = (gkp_combinations, def_combinations, mid_combinations, fwd_combinations)
+    sizes = [size] * len(streams)
+    while True:
+        taken = [stream.take(n) for stream, n in zip(streams, sizes)]
+        squads = lineups(
+            gkp_combinations=taken[0],
+            def_combinations=taken[1],
+            mid_combinations=taken[2],
+            fwd_combinations=taken[3],
+            stats=stats,
+            **kwargs,
+        )
+        if not all(taken):
+            return squads
+
+        best_squad_xp = sum(combinations[0].xP for combinations in taken)
+        if stats.bound > -math.inf:
+            # Out of time, the combinations not taken yet are left out too.
+            stats.bound = max(
+                stats.bound,
+                *(
+                    stream.next_xp() + best_squad_xp - combinations[0].xP
+                    for stream, combinations in zip(streams, taken)
+                ),
+            )
+            return squads
+
+        short = [
+            i
+            for i, (stream, combinations) in enumerate(zip(streams, taken))
+            if stream.next_xp() + best_squad_xp - combinations[0].xP + 1e-9
+            >= stats.cutoff
+        ]
+        if not short:
+            return squads
+
+        for i in short:
+            sizes[i] *= 2
 
 
 def main(
     budget_lower: int,
     budget_upper: int,
+    checkpoint: float,
+    engine: ENGINES,
     gkp_def_not_same_team: bool,
     include: list[str],
     keep_squad: int,
@@ -206,8 +1601,14 @@ def main(
     min_mtm: float,
     min_xp: float,
     no_news: bool,
+    pareto: bool,
     remove: list[str],
+    resume: bool,
+    single_pass: bool,
+    stream: bool,
+    time_limit: float,
     top_position_price: int,
+    workers: int,
 ) -> None:
     pool = [p for p in fetch.players() if p.xP is not None]
     pool = [p for p in pool if p.mtm() >= min_mtm and p.xP >= min_xp]
@@ -246,53 +1647,87 @@ def main(
     pool = list(set(pool))
 
     print(structures.Squad(pool))
-    squads = lineups_xp(
-        gkp_combinations=must_include(
-            position_combinations(
-                pool=[p for p in pool if p.position == "GKP"],
-                combinations=2,
-            ),
-            [p for p in include if p.position == "GKP"],
-        ),
-        def_combinations=must_include(
-            position_combinations(
-                pool=[p for p in pool if p.position == "DEF"],
-                combinations=5,
-            ),
-            [p for p in include if p.position == "DEF"],
-        ),
-        mid_combinations=must_include(
-            position_combinations(
-                pool=[p for p in pool if p.position == "MID"],
-                combinations=5,
-            ),
-            [p for p in include if p.position == "MID"],
-        ),
-        fwd_combinations=must_include(
-            position_combinations(
-                pool=[p for p in pool if p.position == "FWD"],
-                combinations=3,
-            ),
-            [p for p in include if p.position == "FWD"],
-        ),
-        budget_lower=budget_lower,
-        budget_upper=budget_upper,
-        max_players_per_team=max_players_per_team,
-        n_squads=keep_squad,
+    rules = constraints.SquadRules(
+        gkp_def_not_same_team=gkp_def_not_same_team,
+        max_def_per_team=max_def_per_team,
     )
+    stats = SearchStats()
+    deadline = time.monotonic() + time_limit if time_limit else math.inf
+    lineups = (
+        lineups_bnb
+        if engine == "bnb"
+        else lineups_mitm
+        if engine == "mitm"
+        else functools.partial(
+            lineups_xp,
+            # Rescans of a short prefix can take many passes to find enough squads.
+            single_pass=single_pass or stream,
+            workers=workers,
+            checkpoint=checkpoint,
+            resume=resume,
+        )
+    )
+    positions = (("GKP", 2), ("DEF", 5), ("MID", 5), ("FWD", 3))
 
-    if gkp_def_not_same_team:
-        squads = [s for s in squads if constraints.gkp_def_same_team(s.players)]
-
-    if max_def_per_team:
-        squads = [
-            s
-            for s in squads
-            if max(
-                collections.Counter(p.team for p in s if p.position == "DEF").values()
+    if stream:
+        streams = {
+            position: CombinationStream(
+                c
+                for c in iter_position_combinations(
+                    pool=[p for p in pool if p.position == position],
+                    combinations=n,
+                )
+                if all(i in c.players for i in included)
+                and rules.allows_combination(position, c.teams)
             )
-            <= max_def_per_team
-        ]
+            for position, n in positions
+            for included in ([p for p in include if p.position == position],)
+        }
+        squads = lineups_streamed(
+            lineups,
+            gkp_combinations=streams["GKP"],
+            def_combinations=streams["DEF"],
+            mid_combinations=streams["MID"],
+            fwd_combinations=streams["FWD"],
+            budget_lower=budget_lower,
+            budget_upper=budget_upper,
+            max_players_per_team=max_players_per_team,
+            n_squads=keep_squad,
+            stats=stats,
+            deadline=deadline,
+            rules=rules,
+        )
+    else:
+        combinations = {
+            position: must_include(
+                position_combinations(
+                    pool=[p for p in pool if p.position == position],
+                    combinations=n,
+                ),
+                [p for p in include if p.position == position],
+            )
+            for position, n in positions
+        }
+
+        if pareto:
+            combinations = {
+                position: pareto_front(c, keep_squad, same_price=budget_lower > 0)
+                for position, c in combinations.items()
+            }
+
+        squads = lineups(
+            gkp_combinations=combinations["GKP"],
+            def_combinations=combinations["DEF"],
+            mid_combinations=combinations["MID"],
+            fwd_combinations=combinations["FWD"],
+            budget_lower=budget_lower,
+            budget_upper=budget_upper,
+            max_players_per_team=max_players_per_team,
+            n_squads=keep_squad,
+            stats=stats,
+            deadline=deadline,
+            rules=rules,
+        )
 
     # Sort lineups by TSscore.
     squads = sorted(
@@ -325,3 +1760,6 @@ def main(
         f"Max ts: {maxts:.2f}",
         f"Max-Min ts: {(maxts - mints):.2f}",
     )
+
+    if stats.bound > -math.inf:
+        print(f"Time limit reached, optimality gap: {stats.gap():.1f} squad xP")
@@ -175,6 +175,7 @@ def nuke_database() -> None:
     database.execute("""DROP TABLE IF EXISTS game;""")
     database.execute("""DROP TABLE IF EXISTS player;""")
     database.execute("""DROP TABLE IF EXISTS team;""")
+    database.execute("""DROP TABLE IF EXISTS checkpoint;""")
 
 
 def populate_teams() -> None:
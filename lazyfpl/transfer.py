@@ -57,9 +57,7 @@ def transfer(
 
     sold = {
         n: tuple(
-            optimizer.PositionCombination(
-                helpers.squad_price(c), helpers.squad_xP(c), c
-            )
+            optimizer.PositionCombination.fromplayers(c)
             for c in sorted(
                 itertools.combinations(current, n),
                 key=helpers.squad_price,
@@ -77,9 +75,7 @@ def transfer(
     pool = [p for p in pool if p not in current]
     bought = {
         n: tuple(
-            optimizer.PositionCombination(
-                helpers.squad_price(c), helpers.squad_xP(c), c
-            )
+            optimizer.PositionCombination.fromplayers(c)
             for c in sorted(
                 itertools.combinations(pool, n),
                 key=helpers.squad_price,
@@ -0,0 +1,26 @@
+from __future__ import annotations
+
+import pathlib
+from typing import get_args
+
+from lazyfpl import benchmark
+
+
+def test_run_counts_items_and_round_trips(tmp_path: pathlib.Path) -> None:
+    results = benchmark.run(
+        get_args(benchmark.BENCHMARKS),
+        players=20,
+        repeat=1,
+        seed=1,
+        squads=5,
+    )
+    assert [r.name for r in results] == list(get_args(benchmark.BENCHMARKS))
+    assert all(r.items > 0 and r.seconds > 0 and r.peak_kib > 0 for r in results)
+
+    file = tmp_path / "baseline.json"
+    benchmark.save(results, file)
+    assert benchmark.load(file) == results
+
+    rows = benchmark.compare(results, results[:1])
+    assert rows[0]["Speedup"] == 1.0
+    assert rows[1]["Speedup"] is None
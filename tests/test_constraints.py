@@ -68,6 +68,7 @@ def test_team_constraint(
     expected: bool,
 ) -> None:
     assert constraints.team_constraint(lineup, n) == expected
+    assert constraints.tally_constraint(constraints.team_tally(lineup), n) == expected
 
 
 @pytest.mark.parametrize(
@@ -88,3 +89,35 @@ def test_gkp_def_same_team(
     expected: bool,
 ) -> None:
     assert constraints.gkp_def_same_team(lineup) == expected
+    assert (
+        constraints.gkp_def_same_tally(
+            constraints.team_tally(p for p in lineup if p.position == "GKP"),
+            constraints.team_tally(p for p in lineup if p.position == "DEF"),
+        )
+        == expected
+    )
+
+
+@pytest.mark.parametrize("count", range(1, constraints.MAX_LANE_COUNT + 1))
+def test_tally_constraint_matches_team_constraint(count: int) -> None:
+    lineup = [player1] * count + [player3, player4]
+    tally = constraints.team_tally(lineup)
+    for n in range(constraints.MAX_LANE_COUNT + 1):
+        assert constraints.tally_constraint(tally, n) == constraints.team_constraint(
+            lineup, n
+        )
+
+
+def test_squad_rules() -> None:
+    gkps = constraints.team_tally([player1])
+    defs = constraints.team_tally([player2, player2])
+    assert constraints.SquadRules().allows_combination("DEF", defs)
+    assert constraints.SquadRules().allows_gkp_def(gkps, defs)
+
+    rules = constraints.SquadRules(gkp_def_not_same_team=True, max_def_per_team=1)
+    assert rules.restricts("DEF")
+    assert not rules.restricts("MID")
+    assert not rules.allows_combination("DEF", defs)
+    assert rules.allows_combination("MID", defs)
+    assert not rules.allows_gkp_def(gkps, defs)
+    assert rules.allows_gkp_def(gkps, constraints.team_tally([player3]))
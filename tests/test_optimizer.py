@@ -0,0 +1,383 @@
+from __future__ import annotations
+
+import collections
+import functools
+import itertools
+import random
+
+import numpy as np
+import pytest
+
+from lazyfpl import constraints, helpers, optimizer, structures
+
+
+def make_pool(
+    seed: int,
+    *,
+    gkps: int = 3,
+    defs: int = 7,
+    mids: int = 7,
+    fwds: int = 5,
+    teams: int = 10,
+) -> list[structures.Player]:
+    rnd = random.Random(seed)
+    pool = list[structures.Player]()
+    for position, n in (("GKP", gkps), ("DEF", defs), ("MID", mids), ("FWD", fwds)):
+        for i in range(n):
+            team = f"Team{rnd.randrange(teams)}"
+            pool.append(
+                structures.Player(
+                    fixutres=[],
+                    name=f"{position}{i}",
+                    news="",
+                    position=position,  # type: ignore[arg-type]
+                    price=rnd.randrange(40, 90, 5),
+                    selected=0,
+                    team=team,
+                    team_short=team[-2:],
+                    webname=f"{position}{i}",
+                    xP=round(rnd.uniform(1, 12), 1),
+                )
+            )
+    return pool
+
+
+def combinations(
+    pool: list[structures.Player],
+) -> dict[str, list[optimizer.PositionCombination]]:
+    return {
+        position: optimizer.position_combinations(
+            [p for p in pool if p.position == position], n
+        )
+        for position, n in (("GKP", 2), ("DEF", 5), ("MID", 5), ("FWD", 3))
+    }
+
+
+@pytest.mark.parametrize("seed", (0, 1, 4, 5))
+@pytest.mark.parametrize(
+    "budget_lower, budget_upper, n_squads, max_players_per_team",
+    [
+        (0, 10_000, 10, 3),
+        (900, 1_000, 25, 3),
+        (800, 950, 40, 3),
+        (0, 950, 30, 2),
+    ],
+)
+def test_lineups_bnb_matches_lineups_xp(
+    seed: int,
+    budget_lower: int,
+    budget_upper: int,
+    n_squads: int,
+    max_players_per_team: int,
+) -> None:
+    combs = combinations(make_pool(seed))
+    kwargs = {
+        "gkp_combinations": combs["GKP"],
+        "def_combinations": combs["DEF"],
+        "mid_combinations": combs["MID"],
+        "fwd_combinations": combs["FWD"],
+        "budget_lower": budget_lower,
+        "budget_upper": budget_upper,
+        "n_squads": n_squads,
+        "max_players_per_team": max_players_per_team,
+    }
+    loop = optimizer.lineups_xp(**kwargs)  # type: ignore[arg-type]
+    assert len(loop) == n_squads
+    for squads in (
+        optimizer.lineups_bnb(**kwargs),  # type: ignore[arg-type]
+        optimizer.lineups_mitm(**kwargs),  # type: ignore[arg-type]
+        optimizer.lineups_xp(**kwargs, single_pass=True),  # type: ignore[arg-type]
+    ):
+        assert [(round(s.CxP(), 1), s.price()) for s in squads] == [
+            (round(s.CxP(), 1), s.price()) for s in loop
+        ]
+
+
+def test_lineups_xp_single_pass_stats() -> None:
+    combs = combinations(make_pool(0))
+    kwargs = {
+        "gkp_combinations": combs["GKP"],
+        "def_combinations": combs["DEF"],
+        "mid_combinations": combs["MID"],
+        "fwd_combinations": combs["FWD"],
+        "n_squads": 25,
+    }
+    rescan = optimizer.SearchStats()
+    optimizer.lineups_xp(**kwargs, stats=rescan)  # type: ignore[arg-type]
+    single = optimizer.SearchStats()
+    optimizer.lineups_xp(**kwargs, single_pass=True, stats=single)  # type: ignore[arg-type]
+    assert rescan.passes > 1
+    assert single.passes == 1
+    assert single.evaluated < rescan.evaluated
+
+
+def test_lineups_xp_workers_matches_single_pass() -> None:
+    combs = combinations(make_pool(1))
+    kwargs = {
+        "gkp_combinations": combs["GKP"],
+        "def_combinations": combs["DEF"],
+        "mid_combinations": combs["MID"],
+        "fwd_combinations": combs["FWD"],
+        "n_squads": 25,
+        "single_pass": True,
+    }
+    sharded = optimizer.lineups_xp(**kwargs, workers=2)  # type: ignore[arg-type]
+    single = optimizer.lineups_xp(**kwargs)  # type: ignore[arg-type]
+    assert [s.players for s in sharded] == [s.players for s in single]
+
+
+@pytest.mark.parametrize("seed", (0, 4, 5))
+@pytest.mark.parametrize("budget_lower", (0, 850))
+def test_pareto_front_keeps_best_squads(seed: int, budget_lower: int) -> None:
+    n_squads = 3
+    kwargs = {
+        "budget_lower": budget_lower,
+        "budget_upper": 1_000,
+        "n_squads": n_squads,
+        "max_players_per_team": 4,
+    }
+    combs = combinations(make_pool(seed, defs=9, mids=9, teams=4))
+    pruned = {
+        position: optimizer.pareto_front(c, n_squads, same_price=budget_lower > 0)
+        for position, c in combs.items()
+    }
+    assert sum(map(len, pruned.values())) < sum(map(len, combs.values()))
+
+    squads, front = (
+        optimizer.lineups_xp(
+            gkp_combinations=c["GKP"],
+            def_combinations=c["DEF"],
+            mid_combinations=c["MID"],
+            fwd_combinations=c["FWD"],
+            **kwargs,  # type: ignore[arg-type]
+        )
+        for c in (combs, pruned)
+    )
+    assert len(squads) == n_squads
+    # A cheaper equal squad can take the place of a pricier one on ties.
+    assert [round(s.CxP(), 1) for s in front] == [round(s.CxP(), 1) for s in squads]
+    if budget_lower:
+        assert [s.price() for s in front] == [s.price() for s in squads]
+
+
+@pytest.mark.parametrize("seed", (0, 1, 2))
+@pytest.mark.parametrize("size", (1, 2, 3, 5))
+def test_iter_position_combinations_matches_position_combinations(
+    seed: int,
+    size: int,
+) -> None:
+    pool = make_pool(seed, defs=9)
+    pool = [p for p in pool if p.position == "DEF"] + pool[:3]
+    assert list(optimizer.iter_position_combinations(pool, size)) == (
+        optimizer.position_combinations(pool, size)
+    )
+
+
+@pytest.mark.parametrize("seed", (0, 1, 4, 5))
+@pytest.mark.parametrize("engine", ("bnb", "loop", "mitm"))
+def test_lineups_streamed_matches_full_lists(seed: int, engine: str) -> None:
+    pool = make_pool(seed, defs=9, mids=9)
+    kwargs = {
+        "budget_lower": 900,
+        "budget_upper": 1_000,
+        "n_squads": 20,
+    }
+    lineups = (
+        optimizer.lineups_bnb
+        if engine == "bnb"
+        else optimizer.lineups_mitm
+        if engine == "mitm"
+        else functools.partial(optimizer.lineups_xp, single_pass=True)
+    )
+    combs = combinations(pool)
+    stats = optimizer.SearchStats()
+    streamed = optimizer.lineups_streamed(
+        lineups,
+        size=4,
+        stats=stats,
+        **{
+            f"{position.lower()}_combinations": optimizer.CombinationStream(
+                optimizer.iter_position_combinations(
+                    [p for p in pool if p.position == position], n
+                )
+            )
+            for position, n in (("GKP", 2), ("DEF", 5), ("MID", 5), ("FWD", 3))
+        },
+        **kwargs,  # type: ignore[arg-type]
+    )
+    full = lineups(
+        gkp_combinations=combs["GKP"],
+        def_combinations=combs["DEF"],
+        mid_combinations=combs["MID"],
+        fwd_combinations=combs["FWD"],
+        **kwargs,  # type: ignore[arg-type]
+    )
+    assert stats.passes > 1
+    assert [s.players for s in streamed] == [s.players for s in full]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_squad_overall_xp_matches_helpers(seed: int) -> None:
+    rnd = random.Random(seed)
+    combs = combinations(make_pool(seed))
+    for _ in range(50):
+        parts = tuple(rnd.choice(combs[p]) for p in ("GKP", "FWD", "DEF", "MID"))
+        assert optimizer.squad_overall_xP(parts) == helpers.overall_xP(
+            optimizer.squad_players(parts)
+        )
+
+
+@pytest.mark.parametrize("width", (0, 1, 3, 7, 20))
+def test_window_max_matches_brute_force(width: int) -> None:
+    rnd = random.Random(width)
+    values = [rnd.choice((float("-inf"), rnd.uniform(0, 10))) for _ in range(30)]
+    assert optimizer.window_max(np.array(values), width).tolist() == [
+        max(values[i : i + width + 1]) for i in range(len(values))
+    ]
+
+
+@pytest.mark.parametrize("calls", (0, 3, 10, 20))
+@pytest.mark.parametrize("engine", ("bnb", "loop", "mitm"))
+def test_deadline_bounds_squads_left_out(
+    monkeypatch: pytest.MonkeyPatch,
+    engine: str,
+    calls: int,
+) -> None:
+    combs = combinations(make_pool(1, defs=9, mids=9))
+    kwargs = {
+        "gkp_combinations": combs["GKP"],
+        "def_combinations": combs["DEF"],
+        "mid_combinations": combs["MID"],
+        "fwd_combinations": combs["FWD"],
+        "n_squads": 20,
+    }
+    lineups = {
+        "bnb": optimizer.lineups_bnb,
+        "loop": optimizer.lineups_xp,
+        "mitm": optimizer.lineups_mitm,
+    }[engine]
+    full = optimizer.SearchStats()
+    lineups(**kwargs, stats=full)  # type: ignore[operator]
+    assert full.bound == -float("inf")
+
+    # Every clock reading is one tick later, the deadline passes after `calls`.
+    monkeypatch.setattr(optimizer.time, "monotonic", itertools.count().__next__)
+    cut = optimizer.SearchStats()
+    lineups(**kwargs, stats=cut, deadline=calls)  # type: ignore[operator]
+    assert cut.bound > -float("inf")
+    # Squads better than the worst one kept all were searched.
+    assert full.worst <= max(cut.worst, cut.bound) + 1e-9
+
+
+@pytest.mark.parametrize(
+    "single_pass, saves",
+    [
+        (False, 1),
+        (False, 3),
+        # Three GKP combinations, the fourth save is in the second pass.
+        (False, 4),
+        (True, 1),
+        (True, 3),
+    ],
+)
+def test_lineups_xp_resumes_from_checkpoint(
+    monkeypatch: pytest.MonkeyPatch,
+    single_pass: bool,
+    saves: int,
+) -> None:
+    combs = combinations(make_pool(1))
+    kwargs = {
+        "gkp_combinations": combs["GKP"],
+        "def_combinations": combs["DEF"],
+        "mid_combinations": combs["MID"],
+        "fwd_combinations": combs["FWD"],
+        "n_squads": 25,
+        "single_pass": single_pass,
+    }
+    full_stats = optimizer.SearchStats()
+    full = optimizer.lineups_xp(**kwargs, stats=full_stats)  # type: ignore[arg-type]
+
+    class Interrupted(Exception):
+        pass
+
+    checkpoints = dict[str, bytes]()
+
+    # The process dies right after the given number of saves.
+    left = [saves]
+
+    def save_checkpoint(key: str, state: bytes) -> None:
+        checkpoints[key] = state
+        left[0] -= 1
+        if not left[0]:
+            raise Interrupted
+
+    monkeypatch.setattr(optimizer.database, "save_checkpoint", save_checkpoint)
+    monkeypatch.setattr(optimizer.database, "load_checkpoint", checkpoints.get)
+    monkeypatch.setattr(
+        optimizer.database,
+        "delete_checkpoint",
+        lambda key: checkpoints.pop(key, None),
+    )
+    # Every clock reading is one tick later, a one tick interval saves each time.
+    monkeypatch.setattr(optimizer.time, "monotonic", itertools.count().__next__)
+    with pytest.raises(Interrupted):
+        optimizer.lineups_xp(**kwargs, checkpoint=1)  # type: ignore[arg-type]
+    assert len(checkpoints) == 1
+
+    # Another search never picks up the checkpoint.
+    optimizer.lineups_xp(**{**kwargs, "n_squads": 24}, resume=True)  # type: ignore[arg-type]
+    assert len(checkpoints) == 1
+
+    resumed_stats = optimizer.SearchStats()
+    resumed = optimizer.lineups_xp(
+        **kwargs,  # type: ignore[arg-type]
+        stats=resumed_stats,
+        checkpoint=1,
+        resume=True,
+    )
+    assert not checkpoints
+    assert [s.players for s in resumed] == [s.players for s in full]
+    assert resumed_stats.passes == full_stats.passes
+    assert resumed_stats.evaluated == full_stats.evaluated
+
+
+@pytest.mark.parametrize("seed", (0, 1, 4, 5))
+@pytest.mark.parametrize(
+    "rules",
+    [
+        constraints.SquadRules(gkp_def_not_same_team=True),
+        constraints.SquadRules(max_def_per_team=1),
+        constraints.SquadRules(gkp_def_not_same_team=True, max_def_per_team=1),
+    ],
+)
+def test_lineups_follow_rules(seed: int, rules: constraints.SquadRules) -> None:
+    combs = combinations(make_pool(seed, teams=5))
+    kwargs = {
+        "gkp_combinations": combs["GKP"],
+        "def_combinations": combs["DEF"],
+        "mid_combinations": combs["MID"],
+        "fwd_combinations": combs["FWD"],
+        "budget_lower": 0,
+        "n_squads": 20,
+        "rules": rules,
+    }
+    loop = optimizer.lineups_xp(**kwargs)  # type: ignore[arg-type]
+    assert len(loop) == 20
+    for squad in loop:
+        assert not (
+            rules.gkp_def_not_same_team and constraints.gkp_def_same_team(squad)
+        )
+        defs = collections.Counter(p.team for p in squad if p.position == "DEF")
+        assert not rules.max_def_per_team or (
+            max(defs.values()) <= rules.max_def_per_team
+        )
+
+    for squads in (
+        optimizer.lineups_bnb(**kwargs),  # type: ignore[arg-type]
+        optimizer.lineups_mitm(**kwargs),  # type: ignore[arg-type]
+        optimizer.lineups_xp(**kwargs, single_pass=True),  # type: ignore[arg-type]
+        optimizer.lineups_xp(**kwargs, single_pass=True, workers=2),  # type: ignore[arg-type]
+    ):
+        assert [(round(s.CxP(), 1), s.price()) for s in squads] == [
+            (round(s.CxP(), 1), s.price()) for s in loop
+        ]